@@ -4,16 +4,89 @@ import serial # Serial communication
 import serial.tools.list_ports # Serial port listing
 import threading # Threading for background tasks
 import time # Time for sleep and timing
-import csv # CSV file handling
+import math # Scalar maths for the JIT kernel
 import numpy as np # Numpy for data processing
 import matplotlib.pyplot as plt # Matplotlib for plotting
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg # Matplotlib for tkinter
 from tkinter import filedialog, messagebox # Tkinter for file dialogs and message boxes
 from scipy.optimize import curve_fit # Scipy for curve fitting
+from scipy.fft import rfft, rfftfreq, next_fast_len # Scipy real-input FFT
+from scipy.signal import find_peaks # Scipy peak detection
+
+try:
+    from numba import njit, prange # JIT compiler for the mock echo train (optional)
+except ImportError:
+    njit = None
 
 # Configuration
 ctk.set_appearance_mode("System") # GUI appearance
 ctk.set_default_color_theme("green") # GUI color theme
+plt.rcParams["path.simplify"] = True # Merge nearly collinear line segments when rendering
+plt.rcParams["path.simplify_threshold"] = 1.0 # Up to 1 pixel of deviation (long FFT/raw traces)
+
+ABORT_TOO_LATE = "Error: Nothing to abort" # Device reply to ABORT once acquisition has started (sent after the frame)
+
+MOCK_TILE = 1024 # Samples per tile in the NumPy mock generator (fits in L1)
+
+# Pulse timing used by the firmware (main.py): t = 0 is the start of the 90 pulse
+LARMOR_FREQ = 2210.0 # Larmor frequency the firmware pulses at (Hz)
+PULSE90_US = int(1e6 / LARMOR_FREQ / 4.0) # 90 deg pulse length (us), 1/4 period
+PULSE180_US = 2 * PULSE90_US # 180 deg pulse length (us)
+
+def echo_centers(tau, echoes): # Echo n (1..echoes) centre times (us): 90 pulse, then n x (180 pulse + 2*tau)
+    return PULSE90_US + np.arange(1, echoes + 1) * (PULSE180_US + 2 * tau)
+
+def _mock_echo_train_np(t, tau, echoes): # Mock CPMG echo train (NumPy fallback)
+    y = np.empty_like(t)
+    # Add echoes at the firmware's echo centres
+    # very rough simulation of echo train
+    centers = echo_centers(tau, echoes).tolist() # Echo times (Python floats keep y in FP32)
+    # Tiled over time: every echo is accumulated into one cache-resident tile before moving on
+    for i0 in range(0, t.size, MOCK_TILE):
+        ts = t[i0:i0 + MOCK_TILE] # Time tile
+        acc = y[i0:i0 + MOCK_TILE] # Output tile (view)
+        acc[:] = 2048 # Baseline
+        for echo_time_us in centers:
+            # Simple envelope: Gaussian at echo time ~ T2
+            envelope = 1000 * math.exp(-echo_time_us / 50000) # Decay T2 ~ 50ms
+
+            # Each echo is a Gaussian blob
+            acc += envelope * np.exp(-0.5 * ((ts - echo_time_us)/100)**2) # Echo blob
+    return y
+
+if njit is not None: # With Numba: one pass over t, summing every echo per sample (no temporary arrays)
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _mock_echo_train_jit(t, tau, echoes):
+        out = np.full_like(t, 2048.0) # Baseline
+        for i in prange(t.size):
+            ti = t[i]
+            s = 0.0
+            for n in range(1, echoes + 1):
+                ec = PULSE90_US + n * (PULSE180_US + 2 * tau) # Echo time (as echo_centers)
+                env = 1000.0 * math.exp(-ec / 50000.0) # Decay T2 ~ 50ms
+                d = (ti - ec) / 100.0
+                s += env * math.exp(-0.5 * d * d) # Echo blob
+            out[i] += s
+        return out
+
+    mock_echo_train = _mock_echo_train_jit
+else: # Without Numba: tiled NumPy version
+    mock_echo_train = _mock_echo_train_np
+
+def window_argmax(v, lo, hi): # Index of the maximum of v in each window [lo, hi) (windows must be non-empty)
+    # Max per window: reduce over [lo0, hi0, lo1, hi1, ...] and keep the even segments
+    bounds = np.column_stack((lo, hi)).ravel()
+    if bounds[-1] == v.size: # reduceat runs the last segment to the end anyway
+        bounds = bounds[:-1]
+    win_max = np.maximum.reduceat(v, bounds)[::2] # Window maxima
+
+    # Argmax per window: first sample in each window equal to its maximum
+    counts = hi - lo # Samples per window
+    seg = np.repeat(np.arange(lo.size), counts) # Window id of each sample
+    pos = np.arange(counts.sum()) + np.repeat(lo - (np.cumsum(counts) - counts), counts) # Sample index
+    hits = v[pos] == win_max[seg] # Samples at their window maximum
+    _, first = np.unique(seg[hits], return_index=True) # First hit per window
+    return pos[hits][first]
 
 class EFNMRApp(ctk.CTk):
     def __init__(self):
@@ -25,7 +98,11 @@ class EFNMRApp(ctk.CTk):
         self.serial_port = None # Serial port
         self.is_connected = False # Connection status
         self.is_mock = False # Mock mode
-        self.stop_event = threading.Event() # Stop event
+        self.stop_event = threading.Event() # Set to abandon the run in flight (Abort)
+        self._window_cache = {} # Hanning windows keyed by length
+        self._freq_cache = {} # FFT frequency axes keyed by (padded length, dt)
+        self._fft_buf = np.empty(0, dtype=np.float32) # Reusable zero-padded FFT input
+        self._rng = np.random.default_rng() # Mock noise generator
 
         self.setup_ui() # Setup the UI
         
@@ -75,6 +152,9 @@ class EFNMRApp(ctk.CTk):
         self.btn_cpmg = ctk.CTkButton(self.sidebar, text="Run CPMG/Echo", command=self.run_cpmg) # Run CPMG button
         self.btn_cpmg.pack(pady=5, padx=10, fill="x")
         
+        self.btn_abort = ctk.CTkButton(self.sidebar, text="Abort", command=self.abort_run, state="disabled", fg_color="red") # Abort button
+        self.btn_abort.pack(pady=5, padx=10, fill="x")
+        
         self.btn_export = ctk.CTkButton(self.sidebar, text="Export Data", command=self.export_data, state="disabled") # Export data button
         self.btn_export.pack(pady=20, padx=10, fill="x")
 
@@ -93,7 +173,11 @@ class EFNMRApp(ctk.CTk):
         self.ax_raw.set_title("Raw ADC Values vs Time") # Raw plot title
         self.ax_raw.set_xlabel("Time (us)") # Raw plot x label
         self.ax_raw.set_ylabel("ADC Value") # Raw plot y label
-        self.ax_raw.grid(True)
+        self.ax_raw.grid(True, alpha=0.3)
+        self._raw_line, = self.ax_raw.plot([], [], color='#4a90e2', animated=True) # Raw data line (blitted)
+        self._raw_bg = None # Raw plot background without the line
+        self._raw_span = None # Time span the raw axes were scaled for
+        self.canvas_raw.mpl_connect("draw_event", self.on_raw_draw) # Re-capture background on full redraws
 
         # T2 Plot
         self.fig_t2, self.ax_t2 = plt.subplots(figsize=(5, 4), dpi=100) # T2 plot
@@ -113,8 +197,8 @@ class EFNMRApp(ctk.CTk):
         self.ax_fft.set_ylabel("Magnitude")
         self.ax_fft.grid(True)
         
-        self.data_time = [] # Data time
-        self.data_values = [] # Data ADC values (1 ADC unit = 0.8 mV for Pico)
+        self.data_time = np.empty(0, dtype=np.float32) # Data time (FP32 is ample for 12-bit ADC data)
+        self.data_values = np.empty(0, dtype=np.float32) # Data ADC values (1 ADC unit = 0.8 mV for Pico)
         self.t2_time = [] # T2 time
         self.t2_time = [] # T2 time
         self.t2_amp = [] # T2 amplitude
@@ -171,6 +255,17 @@ class EFNMRApp(ctk.CTk):
     def run_cpmg(self): # Run CPMG
         self.run_command("CPMG")
 
+    def set_running(self, running): # Lock out new runs while one is in flight (one receiver per port)
+        state = "disabled" if running else "normal"
+        self.btn_fid.configure(state=state)
+        self.btn_cpmg.configure(state=state)
+        self.btn_abort.configure(state="normal" if running and not self.is_mock else "disabled") # Only the device can abort
+
+    def abort_run(self): # Abort the run in flight (cancels pre-polarisation on the device)
+        self.stop_event.set() # Don't plot this run; the receiver waits for the device's reply
+        self.btn_abort.configure(state="disabled") # One abort per run (one reply to wait for)
+        self.serial_port.write(b"ABORT\n") # Send abort
+
     def run_command(self, cmd_type): # Run command
         if not self.is_connected and not self.is_mock: # If not connected and not mock mode
             messagebox.showwarning("Warning", "Not connected!") # Show warning message
@@ -185,82 +280,117 @@ class EFNMRApp(ctk.CTk):
         except ValueError:
             messagebox.showerror("Error", "Invalid parameters") # Show error message
             return
+        if sleep <= 0 or dsize <= 0 or tau < 0 or echoes < 0: # Out of range for the device and the mock
+            messagebox.showerror("Error", "Invalid parameters") # Show error message
+            return
 
         # Layout cmd: "TYPE,sleep,size,tau,echoes"
         cmd_str = f"{cmd_type},{sleep},{dsize},{tau},{echoes}\n"
         
+        self.set_running(True) # Until the receiver finishes
+        self.stop_event.clear()
         if self.is_mock: # If mock mode
             threading.Thread(target=self.mock_receive, args=(cmd_type, sleep, dsize, tau, echoes)).start()
         else: # If not mock mode
+            self.serial_port.reset_input_buffer() # Drop stale output (e.g. boot banner)
             self.serial_port.write(cmd_str.encode()) # Send command
             threading.Thread(target=self.serial_receive).start()
 
 # CREATING MOCK DATA IF SELECTED MOCK DEVICE MODE
     def mock_receive(self, cmd_type, sleep, dsize, tau, echoes):
-        # Generate fake decaying sine/echo train
-        self.data_time = [] # Data time
-        self.data_values = [] # Data ADC values
-        
-        t = np.linspace(0, dsize * sleep, dsize) # Time
-        
-        if cmd_type == "FID": # If Mock FID
-            # Decaying exponential sine
-            y = 2000 * np.exp(-t/10000) * np.sin(2 * np.pi * 0.00221 * t) + 2048 # Mock FID Curve Data (2210 Hz)
-        else: # If Mock CPMG
-            # CPMG: Series of echoes
-            y = np.ones_like(t) * 2048 # Baseline
-            # Add echoes at 2*tau*n
-            # very rough simulation of echo train
-            for n in range(1, echoes + 1):
-                echo_time_us = (2 * tau * n) # Echo time
-                # Find index relative to time
-                # Simple envelope: Gaussian at echo time ~ T2
-                envelope = 1000 * np.exp(-(n * 2 * tau) / 50000) # Decay T2 ~ 50ms
-                
-                # Each echo is a Gaussian blob
-                blob = envelope * np.exp(-0.5 * ((t - echo_time_us)/100)**2) # Echo blob
-                y += blob
-                
-            # Add noise
-            y += np.random.normal(0, 10, dsize) # Add Mock Noise
+        try:
+            # Generate fake decaying sine/echo train
+            t = np.linspace(0, dsize * sleep, dsize, dtype=np.float32) # Time
+            
+            if cmd_type == "FID": # If Mock FID
+                # Decaying exponential sine
+                y = 2000 * np.exp(-t/10000) * np.sin(2 * np.pi * 0.00221 * t) + 2048 # Mock FID Curve Data (2210 Hz)
+            else: # If Mock CPMG
+                # CPMG: Series of echoes
+                y = mock_echo_train(t, tau, echoes) # Echo train on a 2048 baseline
 
-        self.data_time = t.tolist() # Add mock time data to list
-        self.data_values = y.tolist() # Add mock ADC data to list
-        
-        self.after(0, self.update_plots, cmd_type) # Update plots
+                # Add noise
+                noise = self._rng.standard_normal(dsize, dtype=np.float32) # Mock noise (PCG64)
+                noise *= 10 # Scale to sigma = 10 in place
+                y += noise # Add Mock Noise
+
+            self.data_time = t # Mock time data
+            self.data_values = y # Mock ADC data
+            
+            self.after(0, self.update_plots, cmd_type) # Update plots
+        finally:
+            self.after(0, self.set_running, False) # Run finished (or failed)
 
 # READING REAL DATA IF CONNECTED TO RASPBERRY PI PICO
     def serial_receive(self): 
-        self.data_time = [] # Data time
-        self.data_values = [] # Data ADC values
+        try:
+            self.receive_frame()
+        finally:
+            self.after(0, self.set_running, False) # Run finished (or abandoned)
+
+    def receive_frame(self):
+        # Frame: "DATA,<n_samples>,<sleep_time_us>" header line, then n_samples little-endian uint16 samples
+        n_samples, sleep_time = 0, 0 # Frame size and sample interval
         
         start_time = time.time()
-        while time.time() - start_time < 10: # 10s timeout 
-            if self.serial_port.in_waiting: # If data available
-                line = self.serial_port.readline().decode().strip() # Read line
-                if not line: continue # Skip empty lines
-                if "," in line: # If comma in line
-                    try:
-                        t, v = map(float, line.split(",")) # Split line
-                        self.data_time.append(t) # Add time
-                        self.data_values.append(v) # Add ADC value
-                    except:
-                        pass # Skip invalid lines
+        while time.time() - start_time < 10: # 10s timeout (covers pre-polarisation)
+            line = self.serial_port.readline().decode(errors="ignore").strip() # Blocks up to the 1s port timeout
+            if line == "ABORTED": # Abort reply: pre-polarisation cancelled, no frame will come
+                return
+            if line == ABORT_TOO_LATE: # Abort reply with no frame pending
+                if self.stop_event.is_set(): # Ours: nothing more will come
+                    return
+                continue # Left over from an earlier run's abort
+            if line.startswith("DATA,"): # Frame header
+                n_samples, sleep_time = map(int, line.split(",")[1:3]) # Sample count and interval
+                break
+            if line.startswith("Error"): # Device rejected the command (e.g. "Error: Busy")
+                self.after(0, messagebox.showerror, "Device Error", line) # Show device reply
+                return
+        
+        raw = bytearray() # Raw sample bytes
+        start_time = time.time()
+        while len(raw) < n_samples * 2 and time.time() - start_time < 10: # Until the frame is complete, 10s timeout
+            chunk = self.serial_port.read(n_samples * 2 - len(raw)) # Blocks until the rest arrives or the port times out
+            if chunk: # If data received
+                raw += chunk # Append chunk
                 start_time = time.time() # Reset timeout on data
         
+        if self.stop_event.is_set(): # Aborted once acquisition had started: the device finished the run anyway
+            start_time = time.time()
+            while time.time() - start_time < 10: # Drop the frame and consume the abort reply that follows it
+                if self.serial_port.readline().decode(errors="ignore").strip() == ABORT_TOO_LATE:
+                    break
+            return
+
+        n = len(raw) // 2 # Complete samples received
+        self.data_values = np.frombuffer(raw, dtype="<u2", count=n).astype(np.float32) # Data ADC values
+        self.data_time = np.arange(n, dtype=np.float32) * sleep_time # Data time (us)
+        
         self.after(0, self.update_plots, "CPMG") # Assume CPMG
 
     def update_plots(self, mode): # Update plots
         self.btn_export.configure(state="normal") # Enable export button
         
-        # Raw Plot
-        self.ax_raw.clear() # Clear raw plot
-        self.ax_raw.plot(self.data_time, self.data_values, color='#4a90e2') # Plot raw data
-        self.ax_raw.set_title("ADC Values vs Time") # Set title
-        self.ax_raw.set_xlabel("Time (us)") # Set x label
-        self.ax_raw.set_ylabel("ADC Value") # Set y label
-        self.ax_raw.grid(True, alpha=0.3) # Add grid
-        self.canvas_raw.draw() # Draw canvas
+        # Raw Plot (blitted: only the line is redrawn unless the axes must rescale)
+        t, v = self.data_time, self.data_values
+        self._raw_line.set_data(t, v) # Update line data
+        rescale = False
+        if len(v) > 0:
+            v_lo, v_hi = v.min(), v.max() # Data range
+            y_lo, y_hi = self.ax_raw.get_ylim() # Current view
+            rescale = (self._raw_bg is None or (t[0], t[-1]) != self._raw_span
+                       or v_lo < y_lo or v_hi > y_hi # Data outside the view
+                       or (v_hi - v_lo) < 0.5 * (y_hi - y_lo)) # Data fills under half the view (e.g. weak run after a strong one)
+        if rescale: # New time span, or data outside or much smaller than the view
+            self._raw_span = (t[0], t[-1])
+            self.ax_raw.relim() # Recompute data limits
+            self.ax_raw.autoscale_view() # Rescale axes
+            self.canvas_raw.draw_idle() # Full redraw when Tk is idle (background re-captured in on_raw_draw)
+        elif self._raw_bg is not None: # Same axes: blit the line over the saved background
+            self.canvas_raw.restore_region(self._raw_bg)
+            self.ax_raw.draw_artist(self._raw_line)
+            self.canvas_raw.blit(self.ax_raw.bbox)
         
         # T2 Analysis if CPMG mode
         if mode == "CPMG" and len(self.data_values) > 0: # If CPMG mode and data available
@@ -270,38 +400,57 @@ class EFNMRApp(ctk.CTk):
         if len(self.data_values) > 0:
             self.analyze_fft()
             
+    def on_raw_draw(self, event): # Save the raw plot background after a full redraw
+        self._raw_bg = self.canvas_raw.copy_from_bbox(self.ax_raw.bbox)
+        self.ax_raw.draw_artist(self._raw_line) # Animated line is skipped by draw(), add it back
+
     def analyze_t2(self): # Analyse T2
         # Extract peaks from echo train
-        # Simple algorithm: Find local maxima in windows expected by Tau
+        # Simple algorithm: Find prominent local maxima spaced by roughly 2*Tau
         try:
             tau = int(self.entry_tau.get()) # Get tau
             echoes = int(self.entry_num.get()) # Get echoes
             
-            peaks_t = [] # Peaks time
-            peaks_v = [] # Peaks ADC values
-            
-            arr_t = np.array(self.data_time) # Data time
-            arr_v = np.array(self.data_values) # Data ADC values
+            arr_t = self.data_time # Data time
+            arr_v = self.data_values # Data ADC values
             baseline = 2048 # ADC mid-point approximately
-            
+
             # Refine baseline
-            baseline = np.min(arr_v) 
-            
-            for n in range(1, echoes + 1): # For each echo
-                center_time = 2 * tau * n # Center time
-                # Search window +/- tau/2
-                mask = (arr_t > center_time - tau/2) & (arr_t < center_time + tau/2)
-                if np.any(mask): # If mask is not empty
-                    window_v = arr_v[mask] # Window ADC values
-                    window_t = arr_t[mask] # Window time
-                    
-                    peak_idx = np.argmax(window_v) # Peak index
-                    peak_val = window_v[peak_idx] - baseline # Peak ADC values
-                    peak_time = window_t[peak_idx] # Peak time
-                    
-                    peaks_t.append(peak_time / 1000.0) # Convert to ms
-                    peaks_v.append(peak_val) # Append peak ADC values
-            
+            baseline = np.min(arr_v)
+
+            # Echo windows: firmware echo centres, +/- tau/2 (time is sorted, so bisect once)
+            centers = echo_centers(tau, echoes) # Centre times
+            lo = np.searchsorted(arr_t, centers - tau/2, side="right") # First sample inside each window
+            hi = np.searchsorted(arr_t, centers + tau/2, side="left") # First sample past each window
+            keep = lo < hi # Drop empty windows
+            lo, hi = lo[keep], hi[keep]
+
+            # Noise level: echoes are smooth, so sample-to-sample steps are mostly noise (robust sigma via MAD)
+            steps = np.diff(arr_v) # Sample-to-sample steps
+            noise = 1.4826 * np.median(np.abs(steps - np.median(steps))) / np.sqrt(2) if steps.size else 0.0
+
+            # Echo peaks: local maxima at least 1.5*tau apart (echoes are 2*tau + 180 pulse apart), 3 sigma above the noise
+            dt_us = (arr_t[-1] - arr_t[0]) / (len(arr_t) - 1) if len(arr_t) > 1 else 1.0 # Sample interval
+            peak_idx, _ = find_peaks(arr_v, distance=max(1, int(1.5 * tau / dt_us)), prominence=3 * noise) # Peak indices
+
+            # One peak per echo window: the highest find_peaks hit inside it, else the window maximum
+            # (hits between windows are noise bumps and are dropped)
+            if lo.size > 0:
+                win = np.searchsorted(lo, peak_idx, side="right") - 1 # Last window starting at or before each hit
+                inside = win >= 0
+                inside[inside] = peak_idx[inside] < hi[win[inside]] # Hit lies before that window's end
+                hits, win = peak_idx[inside], win[inside]
+
+                order = np.argsort(-arr_v[hits], kind="stable") # Highest hits first
+                first_win, first = np.unique(win[order], return_index=True) # Highest hit per window
+                peak_idx = window_argmax(arr_v, lo, hi) # Fallback for windows without a hit (weak or overlapping echoes)
+                peak_idx[first_win] = hits[order][first]
+            else:
+                peak_idx = peak_idx[:0] # No echo window inside the capture
+
+            peaks_t = arr_t[peak_idx] / 1000.0 # Convert to ms
+            peaks_v = arr_v[peak_idx] - baseline # Peak ADC values
+
             self.ax_t2.clear() # Clear T2 plot
             self.ax_t2.scatter(peaks_t, peaks_v, color='red', label='Echo Peaks') # Scatter peaks
             
@@ -309,9 +458,26 @@ class EFNMRApp(ctk.CTk):
             if len(peaks_t) > 2: # If more than 2 peaks
                 def decay(t, a, t2): # Decay function
                     return a * np.exp(-t / t2)
-                
+
+                def decay_jac(t, a, t2): # Analytic Jacobian [dV/dA, dV/dT2]
+                    e = np.exp(-t / t2)
+                    return np.stack([e, a * t * e / (t2 * t2)], axis=1)
+
+                # Initial guess from a line through log(V): ln V = ln A - t/T2
+                # (weighted by V so the noisy tail does not dominate)
+                p0 = [max(peaks_v), 10.0] # Fallback guess
+                pos = peaks_v > 0 # Log needs positive peaks
+                if np.count_nonzero(pos) > 1:
+                    try:
+                        slope, intercept = np.polyfit(peaks_t[pos], np.log(peaks_v[pos]), 1, w=peaks_v[pos])
+                        if slope < 0 and np.isfinite(intercept): # Decaying, usable seed
+                            p0 = [np.exp(intercept), -1.0 / slope]
+                    except (np.linalg.LinAlgError, ValueError): # Degenerate peaks: keep the fallback guess
+                        pass
+
                 try:
-                    popt, _ = curve_fit(decay, peaks_t, peaks_v, p0=[max(peaks_v), 10.0]) # Curve fit
+                    popt, _ = curve_fit(decay, peaks_t, peaks_v, p0=p0, jac=decay_jac,
+                                        check_finite=False, xtol=1e-5, ftol=1e-5) # Curve fit
                     t2_val = popt[1] # T2 value
                     
                     fit_t = np.linspace(min(peaks_t), max(peaks_t), 100) # Fit time
@@ -328,7 +494,7 @@ class EFNMRApp(ctk.CTk):
             self.ax_t2.set_title("T2 Relaxation Analysis") # Set title
             self.ax_t2.set_xlabel("Time (ms)") # Set x label
             self.ax_t2.set_ylabel("Peak Amplitude") # Set y label
-            self.canvas_t2.draw() # Draw canvas
+            self.canvas_t2.draw_idle() # Draw canvas when Tk is idle
             
         except Exception as e: # If error
             print(f"T2 Analysis Error: {e}") # Print error
@@ -336,7 +502,7 @@ class EFNMRApp(ctk.CTk):
     def analyze_fft(self):
         try:
             # 1. Prepare Data
-            data = np.array(self.data_values)
+            data = np.asarray(self.data_values, dtype=np.float32)
             n = len(data)
             if n == 0: return
 
@@ -350,31 +516,44 @@ class EFNMRApp(ctk.CTk):
                 dt = float(self.entry_sleep.get()) * 1e-6
 
             # 2. Pre-processing
-            # Remove DC Offset
-            data = data - np.mean(data)
-            
             # Windowing (Hanning) to reduce spectral leakage
-            window = np.hanning(n)
-            data_windowed = data * window
+            # Reuse the window when the data size has not changed
+            window = self._window_cache.get(n)
+            if window is None:
+                window = np.hanning(n).astype(np.float32)
+                self._window_cache[n] = window
+            
+            # Zero Filling (Pad to at least 4x length for smoother plot,
+            # rounded up to a length the FFT backend factorises efficiently)
+            n_padded = next_fast_len(n * 4, real=True)
+            if self._fft_buf.size < n_padded: # Grow the reusable buffer only when needed
+                self._fft_buf = np.empty(n_padded, dtype=np.float32)
+            fft_in = self._fft_buf[:n_padded] # Padded FFT input (view)
             
-            # Zero Filling (Pad to 4x length for smoother plot)
-            n_padded = n * 4
+            # Remove DC Offset, then window, both in place in the FFT buffer
+            np.subtract(data, data.mean(), out=fft_in[:n])
+            np.multiply(fft_in[:n], window, out=fft_in[:n])
+            fft_in[n:] = 0 # Zero padding
             
-            # 3. Compute FFT
-            fft_complex = np.fft.fft(data_windowed, n=n_padded)
-            fft_mag = np.abs(fft_complex)
-            fft_freq = np.fft.fftfreq(n_padded, d=dt)
+            # 3. Compute FFT (real input, so only the positive half is computed)
+            fft_complex = rfft(fft_in, workers=-1, overwrite_x=True)
+            self.fft_mag = np.abs(fft_complex)
+            key = (n_padded, float(dt)) # Same size and sample interval -> same axis
+            self.fft_freq = self._freq_cache.get(key)
+            if self.fft_freq is None:
+                self.fft_freq = rfftfreq(n_padded, d=dt)
+                self._freq_cache[key] = self.fft_freq
             
-            # 4. Filter for Positive Frequencies only
-            pos_mask = fft_freq >= 0
-            self.fft_freq = fft_freq[pos_mask]
-            self.fft_mag = fft_mag[pos_mask]
+            # 4. Plotting
+            # Decimate to ~2000 points for drawing, keeping the max of each block so narrow lines survive
+            step = max(1, len(self.fft_mag) // 2000) # Bins per plotted point
+            plot_mag = np.maximum.reduceat(self.fft_mag, np.arange(0, len(self.fft_mag), step)) # Block maxima
+            plot_freq = self.fft_freq[::step] # Block start frequencies
             
-            # 5. Plotting
             self.ax_fft.clear()
-            self.ax_fft.plot(self.fft_freq, self.fft_mag, color='#e74c3c')
+            self.ax_fft.plot(plot_freq, plot_mag, color='#e74c3c')
             
-            # Find Peak
+            # Find Peak (on the full-resolution spectrum)
             if len(self.fft_mag) > 0:
                 peak_idx = np.argmax(self.fft_mag)
                 peak_freq = self.fft_freq[peak_idx]
@@ -389,7 +568,7 @@ class EFNMRApp(ctk.CTk):
             self.ax_fft.set_xlabel("Frequency (Hz)")
             self.ax_fft.set_ylabel("Magnitude")
             self.ax_fft.grid(True, alpha=0.3)
-            self.canvas_fft.draw()
+            self.canvas_fft.draw_idle()
             
         except Exception as e:
             print(f"FFT Error: {e}")
@@ -397,19 +576,14 @@ class EFNMRApp(ctk.CTk):
     def export_data(self): # Export data
         filename = filedialog.asksaveasfilename(defaultextension=".csv") # Ask for filename
         if filename: # If filename is not empty
-            with open(filename, 'w', newline='') as f: # Open file
-                writer = csv.writer(f) # CSV writer
-                writer.writerow(["Time_us", "ADC_Value"]) # Write header
-                for t, v in zip(self.data_time, self.data_values): # For each data point
-                    writer.writerow([t, v]) # Write data point
+            data = np.column_stack((self.data_time, self.data_values)) # Time/value columns
+            np.savetxt(filename, data, delimiter=",", header="Time_us,ADC_Value", fmt="%.8g", comments="") # Write CSV
             
             # Save T2 data if exists
             if hasattr(self, 't2_time') and len(self.t2_time) > 0: # If T2 data exists
-                with open(filename.replace(".csv", "_T2.csv"), 'w', newline='') as f: # Open file
-                    writer = csv.writer(f) # CSV writer
-                    writer.writerow(["Time_ms", "Peak_Amplitude"]) # Write header
-                    for t, v in zip(self.t2_time, self.t2_amp): # For each data point
-                        writer.writerow([t, v]) # Write data point
+                t2_data = np.column_stack((self.t2_time, self.t2_amp)) # Time/amplitude columns
+                np.savetxt(filename.replace(".csv", "_T2.csv"), t2_data, delimiter=",",
+                           header="Time_ms,Peak_Amplitude", fmt="%.8g", comments="") # Write CSV
 
 if __name__ == "__main__": # If main
     app = EFNMRApp() # Create app
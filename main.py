@@ -1,21 +1,91 @@
+import array
 import machine
+import micropython
+from micropython import const
 import rp2
 import uctypes
 import time
 import sys
 import select
+import _thread
 
 # ==============================================================================
 # Global Configuration & Hardware Pins
 # ==============================================================================
+# Integer settings are wrapped in const() so the compiler inlines their values
+# instead of looking them up in the module globals at every use. LARMOR_FREQ
+# and the values derived from it are floats (or computed from floats), which
+# const() cannot hold.
 LARMOR_FREQ = 2210.0  # Target Larmor frequency for Earth's Field NMR (Hz)
 
 # GPIO Pin Assignments
-LED_PIN = 25          # Onboard LED (Raspberry Pi Pico)
-ADC_PIN = 28          # ADC Input 2 (GP28) - Connected to NMR coil amplifier output
-PULSE_PIN = 16        # Output to H-Bridge/Transmitter for RF pulses
-PP_COIL_PIN = 26      # Output to Pre-Polarization coil relay/MOSFET
-DET_SWITCH_PIN = 22   # Output to Rx/Tx switching relay (Isolation switch)
+LED_PIN = const(25)          # Onboard LED (Raspberry Pi Pico)
+ADC_PIN = const(28)          # ADC Input 2 (GP28) - Connected to NMR coil amplifier output
+PULSE_PIN = const(16)        # Output to H-Bridge/Transmitter for RF pulses
+PP_COIL_PIN = const(26)      # Output to Pre-Polarization coil relay/MOSFET
+DET_SWITCH_PIN = const(22)   # Output to Rx/Tx switching relay (Isolation switch)
+
+# PIO Timing
+# These depend only on LARMOR_FREQ and the PIO clock, so they are computed
+# once at import rather than on every command.
+PIO_FREQ = const(125_000_000)                        # PIO state machine clock (Hz)
+CYCLES_PER_US = const(125)                           # PIO cycles per microsecond at 125MHz
+PERIOD_US = 1_000_000.0 / LARMOR_FREQ                # Larmor period (us)
+PULSE_CYCLES = int(PERIOD_US / 4.0) * CYCLES_PER_US  # 90 deg pulse approx 1/4 period
+PULSE180_CYCLES = PULSE_CYCLES * 2                   # 180 deg pulse
+
+# ADC Hardware Registers
+# We need to access hardware registers to enable the FIFO and Request signals
+# that standard MicroPython `ADC` class doesn't expose deeply enough for DMA.
+ADC_BASE = const(0x4004c000)
+ADC_CS = const(ADC_BASE + 0x00)    # Control and Status
+ADC_FCS = const(ADC_BASE + 0x08)   # FIFO Control and Status
+ADC_FIFO = const(ADC_BASE + 0x0C)  # Conversion result FIFO
+ADC_DIV = const(ADC_BASE + 0x10)   # Clock Divider
+
+# SIO GPIO output clear (write 1 to drive a pin low, other pins untouched)
+SIO_GPIO_OUT_CLR = const(0xd0000018)
+
+# PIO0 SM0 RX FIFO and its DREQ (used to start the ADC from the PIO)
+PIO0_RXF0 = const(0x50200020)
+DREQ_PIO0_RX0 = const(4)
+# PIO0 SM0 SHIFTCTRL: toggling [31] FJOIN_RX clears both SM0 FIFOs
+PIO0_SM0_SHIFTCTRL = const(0x502000d0)
+
+# ADC Register Values
+# Every field that matters is known in advance, so the registers are written
+# with these whole words rather than read-modify-write on each command.
+# CS bits: [0] EN, [3] START_MANY (continuous capture), [12:14] AINSEL = 2 (GP28)
+ADC_CS_RUN = const((1 << 0) | (1 << 3) | (2 << 12))   # Free-running on input 2
+ADC_CS_STOP = const((1 << 0) | (2 << 12))             # Enabled and muxed, but idle
+# FCS bits: [0] EN, [3] DREQ_EN (request DMA when data available),
+# [24:27] THRESH = 1 (trigger when at least 1 sample in FIFO)
+ADC_FCS_DMA = const((1 << 0) | (1 << 3) | (1 << 24))
+
+# Pre-Polarisation
+POLARIZE_MS = const(3000)    # Polarize for 3 seconds (adjust as needed for T1)
+
+# Command loop states
+IDLE = const(0)              # Waiting for a command
+POLARIZING = const(1)        # Pre-polarisation coil on, acquisition pending
+
+# Sample Buffers
+# Allocated once at start-up and reused by every acquisition. A fresh 40KB
+# bytearray per command costs a zero-fill plus a garbage collection, and on
+# the RP2040's 264KB heap can eventually fail through fragmentation.
+# Two buffers are used in turn ("ping-pong"): the DMA fills one while core 1
+# is still sending the previous capture from the other.
+MAX_SAMPLES = const(20000)            # Safety cap for RAM (16-bit samples)
+BUFS = (bytearray(MAX_SAMPLES * 2),   # ADC sample buffers, 2 bytes per sample
+        bytearray(MAX_SAMPLES * 2))
+
+# PIO Parameter Block
+# The six words the cpmg program pulls, in order. Filled in per command and
+# pushed with a single sm.put() call; the fixed entries are set once here.
+PARAMS = array.array('I', [0] * 6)
+PARAMS[0] = ADC_CS_RUN          # ADC start word
+PARAMS[1] = PULSE_CYCLES        # 90 pulse length
+PARAMS[4] = PULSE180_CYCLES     # 180 pulse length
 
 # ==============================================================================
 # PIO (Programmable I/O) Program: CPMG Sequence
@@ -34,16 +104,29 @@ DET_SWITCH_PIN = 22   # Output to Rx/Tx switching relay (Isolation switch)
 #
 # HOW IT WORKS:
 # This program generates the CPMG (Carr-Purcell-Meiboom-Gill) pulse sequence:
-# 90_pulse -> tau -> [180_pulse -> tau -> trigger_adc -> tau] * N_echoes
+# start_adc -> 90_pulse -> tau -> [180_pulse -> tau -> echo -> tau] * N_echoes
 #
 # The 'sideset' pin is the PULSE_PIN. .side(1) turns it ON, .side(0) turns it OFF.
 #
+# ADC SYNCHRONISATION:
+# The RP2040 ADC has no external trigger input, so the PIO starts it through
+# DMA: the CPU hands the PIO the ADC_CS "run" word (EN | START_MANY | mux),
+# and the PIO pushes it to its RX FIFO on the cycle before the 90 pulse.
+# A DMA channel paced by that FIFO's DREQ copies it straight into ADC_CS, so
+# free-running sampling starts a few clock cycles before the pulse instead of
+# "roughly together" from Python. Sample 0 is therefore t = 0 of the sequence.
+#
 @rp2.asm_pio(sideset_init=rp2.PIO.OUT_LOW)
 def cpmg():
+    # --- PHASE 0: ADC Start Word ---
+    pull()                  # Load the ADC_CS run word from FIFO (CPU)
+    mov(isr, osr)           # Stage it in ISR until the 90 pulse
+    
     # --- PHASE 1: Initial 90 degree Pulse ---
     pull()                  # Load 90_pulse duration (in cycles) from FIFO (CPU) to OSR
     mov(y, osr)             # Move value to Y scratch register
     
+    push()                  # Start ADC: ISR -> RX FIFO -> (DMA) -> ADC_CS
     nop().side(1)           # Turn PULSE ON
     label("loop_90")
     jmp(y_dec, "loop_90")   # Delay for duration Y
@@ -81,9 +164,9 @@ def cpmg():
     label("loop_wait_1")
     jmp(y_dec, "loop_wait_1")
     
-    # 3. TRIGGER ACQUISITION
-    # This pulses the IRQ flag. The DMA controller is configured to wait 
-    # for data from the ADC, which effectively syncs here.
+    # 3. ECHO CENTRE
+    # Raises PIO IRQ flag 0 at the echo centre. Sampling itself runs
+    # continuously from PHASE 0, so this is only a marker.
     irq(0)                  
     
     # 4. Wait Tau (Echo Center -> Next 180)
@@ -124,9 +207,8 @@ class DMADriver:
         self.CTRL_TRIG = self.ch_base + 0x0C    # Control and Trigger
         self.AL1_CTRL = self.ch_base + 0x10     # Control (Write-only, no trigger)
         
-        # ADC Base Address (for FIFO access)
-        self.ADC_BASE = 0x4004c000
-        self.ADC_FIFO = self.ADC_BASE + 0x08
+        # CHAIN_TO field [11:14]: pointing a channel at itself disables chaining
+        self.CHAIN_SELF = channel << 11
         
     def config(self, buffer, count):
         """
@@ -147,25 +229,46 @@ class DMADriver:
         # [2:3] SIZE = 1 (0x1) -> 2 bytes
         # [4] INCR_READ = 0
         # [5] INCR_WRITE = 1
+        # [11:14] CHAIN_TO = own channel (no chaining)
         # [15:20] TREQ_SEL = 36 (0x24)
         
         ctrl = 0
         ctrl |= (1 << 0)   # Enable
         ctrl |= (1 << 2)   # 16-bit
         ctrl |= (1 << 5)   # Incr Write
+        ctrl |= self.CHAIN_SELF
         ctrl |= (36 << 15) # DREQ_ADC (36 is the DREQ ID for ADC on RP2040)
         
         # Get physical address of the buffer
         driver_addr = uctypes.addressof(buffer)
         
         # Write configuration
-        machine.mem32[self.READ_ADDR] = self.ADC_FIFO  # Read from ADC
+        machine.mem32[self.READ_ADDR] = ADC_FIFO       # Read from ADC
         machine.mem32[self.WRITE_ADDR] = driver_addr   # Write to Buffer
         machine.mem32[self.TRANS_COUNT] = count        # How many samples
         
-        # Write Control register (using Alias that doesn't trigger immediately, 
-        # though DREQ logic means it will wait for ADC anyway)
-        machine.mem32[self.AL1_CTRL] = ctrl
+        # Write Control register through the trigger alias. This arms the
+        # channel; it then moves one sample per DREQ_ADC. (Writing the
+        # non-triggering AL1_CTRL alias leaves the channel idle for good.)
+        machine.mem32[self.CTRL_TRIG] = ctrl
+
+    def config_word(self, src, dst, treq):
+        """
+        Configures the DMA channel to copy one 32-bit word from 'src' to 'dst'
+        as soon as peripheral request 'treq' fires.
+        """
+        machine.mem32[self.CTRL_TRIG] = 0
+        
+        ctrl = 0
+        ctrl |= (1 << 0)     # Enable
+        ctrl |= (2 << 2)     # 32-bit
+        ctrl |= self.CHAIN_SELF
+        ctrl |= (treq << 15) # Paced by 'treq'
+        
+        machine.mem32[self.READ_ADDR] = src
+        machine.mem32[self.WRITE_ADDR] = dst
+        machine.mem32[self.TRANS_COUNT] = 1
+        machine.mem32[self.CTRL_TRIG] = ctrl  # Arm: waits for 'treq'
 
     def wait(self):
         """
@@ -178,6 +281,87 @@ class DMADriver:
     def disable(self):
         machine.mem32[self.CTRL_TRIG] = 0
 
+# ==============================================================================
+# ADC Register Helpers (Native Code)
+# ==============================================================================
+#
+# These run between the end of pre-polarisation and the PIO kick, so they are
+# compiled by the viper emitter: ptr32() gives direct word access to the ADC
+# registers (index = offset / 4) without going through machine.mem32 and the
+# bytecode interpreter.
+#
+@micropython.viper
+def adc_arm(div: int):
+    """
+    Sets the ADC clock divider, routes results to the FIFO/DMA and leaves the
+    ADC idle on the NMR input, with any stale samples discarded.
+    """
+    adc = ptr32(ADC_BASE)
+    adc[4] = div << 8                   # DIV: register takes 8.8 fixed point
+    adc[2] = int(ADC_FCS_DMA)           # FCS: FIFO + DREQ enabled
+    adc[0] = int(ADC_CS_STOP)           # CS: input 2 selected, not sampling
+    
+    # Discard samples left in the FIFO by the previous run so that
+    # the first sample the DMA takes is the one at t = 0
+    while not (adc[2] & (1 << 8)):      # FCS [8] EMPTY
+        adc[3]                          # Pop FIFO
+
+@micropython.viper
+def teardown():
+    """
+    Ends an acquisition: stops free-running conversions (clears START_MANY),
+    then opens the Rx switch and turns the LED off in one GPIO write.
+    """
+    ptr32(ADC_BASE)[0] = int(ADC_CS_STOP)
+    ptr32(SIO_GPIO_OUT_CLR)[0] = (1 << DET_SWITCH_PIN) | (1 << LED_PIN)
+
+# ==============================================================================
+# Data Transmission (Second Core)
+# ==============================================================================
+#
+# WHY A SECOND CORE?
+# Streaming a 40KB capture over USB takes far longer than the acquisition
+# itself, and while core 0 is busy printing it cannot accept the next command.
+# The RP2040 has two cores: a worker thread started once on core 1 sends
+# each finished buffer, and core 0 goes straight back to the command loop, so
+# the transfer of one capture overlaps the pre-polarisation of the next.
+# (Core 1 runs a single thread, so it is kept alive rather than started per
+# frame: a new thread raises "core1 in use" until the previous one has exited.)
+#
+# Two locks hand frames over:
+# - 'ready' is released by core 0 when 'job' holds a new frame to send.
+# - 'lock' is held from the hand-over until core 1 has written the last byte.
+# Acquisitions alternate between the two BUFS, so the capture being sent is
+# never the one being filled; core 0 only takes 'lock' to hand over the next
+# frame and to print, so its lines don't land inside a frame.
+#
+def transmit(buf, datasize, sleep_time):
+    """
+    Sends one acquisition frame to the PC.
+    """
+    # Format: "DATA,<n_samples>,<sleep_time_us>\n" header line, then
+    #         n_samples * 2 raw bytes (16-bit samples as written by the DMA)
+    # The RP2040 is little-endian and the DMA stores each ADC result as
+    # a uint16, so `buf` already is the wire format: no sample is decoded
+    # on the Pico, the PC reinterprets the block in one go ('<u2').
+    # The PC reconstructs time as sample_index * sleep_time.
+    sys.stdout.write("DATA,%d,%d\n" % (datasize, sleep_time))
+    sys.stdout.buffer.write(memoryview(buf)[:datasize * 2])  # Raw stream: no newline translation
+
+def tx_worker(job, ready, lock):
+    """
+    Core 1 loop: waits for 'ready', sends the frame in 'job'
+    ([buf, datasize, sleep_time]), then releases 'lock'.
+    """
+    while True:
+        ready.acquire()         # Sleep until core 0 hands over a frame
+        try:
+            transmit(*job)
+        except OSError:
+            pass                # Host went away mid-frame; drop it
+        finally:
+            lock.release()      # Buffer is free again
+
 # ==============================================================================
 # Main Application Logic
 # ==============================================================================
@@ -194,145 +378,201 @@ def main():
     # ADC Setup
     adc = machine.ADC(ADC_PIN) 
     
-    # --- ADC Hardware Register Setup ---
-    # We need to access hardware registers to enable the FIFO and Request signals
-    # that standard MicroPython `ADC` class doesn't expose deeply enough for DMA.
-    ADC_BASE = 0x4004c000
-    ADC_CS = ADC_BASE + 0x00   # Control and Status
-    ADC_FCS = ADC_BASE + 0x0C  # FIFO Control and Status
-    ADC_DIV = ADC_BASE + 0x10  # Clock Divider
-    
     # Initialize PIO
     # standard frequency 125MHz ensures 1 cycle = 8ns.
-    sm = rp2.StateMachine(0, cpmg, freq=125_000_000, sideset_base=pulse_pin)
+    # The program is assembled and loaded into PIO memory once, here. Each
+    # command only calls sm.restart() and pushes new parameters, so nothing
+    # is re-assembled on the acquisition path.
+    sm = rp2.StateMachine(0, cpmg, freq=PIO_FREQ, sideset_base=pulse_pin)
     sm.active(1)
 
     # Initialize DMA
-    dma = DMADriver(channel=0)
+    dma = DMADriver(channel=0)          # ADC FIFO -> BUFS[acq_idx]
+    adc_trig = DMADriver(channel=1)     # PIO RX FIFO -> ADC_CS (ADC start)
+    
+    # Start the transmit worker on core 1 (see tx_worker())
+    tx_job = [None, 0, 0]               # Frame to send: buf, datasize, sleep_time
+    tx_ready = _thread.allocate_lock()  # Released when tx_job holds a new frame
+    tx_ready.acquire()                  # Nothing to send yet
+    tx_lock = _thread.allocate_lock()   # Held while a frame is being sent
+    _thread.start_new_thread(tx_worker, (tx_job, tx_ready, tx_lock))
+    acq_idx = 0                         # Buffer the next acquisition fills
+    
+    # Register stdin with a poll object once; select.select() would rebuild
+    # its argument and result lists on every pass of the idle loop.
+    poller = select.poll()
+    poller.register(sys.stdin, select.POLLIN)
     
     print("EFNMR MicroPython Controller Ready")
-    print("Waiting for commands (CPMG, FID)...")
+    print("Waiting for commands (CPMG, FID, ABORT)...")
+
+    # Command loop state
+    # Pre-polarisation is the longest wait in the sequence, so it is timed with
+    # ticks instead of sleep(): the loop keeps servicing stdin (e.g. ABORT)
+    # while the coil is on, and core 1 can finish sending the last capture.
+    state = IDLE
+    polarize_until = 0  # ticks_ms deadline for the current polarisation
+    pending = None      # (sleep_time, req_datasize, tau_us, n_echoes) of the queued run
 
     while True:
         # Non-blocking check for input commands
-        if select.select([sys.stdin], [], [], 0)[0]:
+        if poller.poll(0):
             line = sys.stdin.readline().strip()
             if not line: continue
             
-            parts = line.split(',')
-            if len(parts) == 0: continue
+            parts = line.split(',')     # Never empty: line is non-blank
             cmd = parts[0]
             
-            if cmd == "CPMG" or cmd == "FID":
+            if cmd == "ABORT":
+                # Cancel a pending run (coil off, nothing acquired). Always
+                # answered, so the PC knows whether a frame is still coming:
+                # once acquisition has started the run completes, and this
+                # reply follows its frame.
+                if state == POLARIZING:
+                    pp_coil.value(0)
+                    led.value(0)
+                    state = IDLE
+                    with tx_lock:   # Don't interleave with a frame being sent
+                        print("ABORTED")
+                else:
+                    with tx_lock:   # Don't interleave with a frame being sent
+                        print("Error: Nothing to abort")
+            
+            elif cmd == "CPMG" or cmd == "FID":
+                if state != IDLE:
+                    with tx_lock:   # Don't interleave with a frame being sent
+                        print("Error: Busy")
+                    continue
+                
                 try:
                     # Parse Parameters
                     # Command format: DATA_TYPE, SLEEP_TIME, DATA_SIZE, TAU_US, N_ECHOES
-                    sleep_time = int(parts[1]) # Interval between samples (affects ADC rate)
-                    req_datasize = int(parts[2]) # Requested number of samples
-                    tau_us = int(parts[3])     # Tau delay (half echo spacing)
-                    n_echoes = int(parts[4])   # Number of echoes
-                except (IndexError, ValueError) as e:
-                    print(f"Error: Invalid Arguments - {e}")
+                    #   SLEEP_TIME: Interval between samples (affects ADC rate)
+                    #   DATA_SIZE:  Requested number of samples
+                    #   TAU_US:     Tau delay (half echo spacing)
+                    #   N_ECHOES:   Number of echoes
+                    # One positional unpack: a wrong field count or a bad
+                    # number both raise ValueError.
+                    sleep_time, req_datasize, tau_us, n_echoes = map(int, parts[1:])
+                except ValueError as e:
+                    with tx_lock:   # Don't interleave with a frame being sent
+                        print(f"Error: Invalid Arguments - {e}")
                     continue
                 
-                # --- Step 1: Pre-Polarization ---
-                # Turn on the strong magnet coil to align spins
-                led.value(1)
-                pp_coil.value(1)
-                time.sleep(3)       # Polarize for 3 seconds (adjust as needed for T1)
-                pp_coil.value(0)    # Turn off quickly
-                
-                # --- Step 2: Calculate Timing & Cycles ---
-                # Convert times to PIO clock cycles (125 cycles per microsecond at 125MHz)
-                period = 1_000_000.0 / LARMOR_FREQ
-                pulse_time = int(period / 4.0)          # 90 degree pulse approx 1/4 period
-                
-                pulse_cycles = int(pulse_time * 125)    # 90 deg pulse cycles
-                pulse180_cycles = pulse_cycles * 2      # 180 deg pulse cycles
-                tau_cycles = int(tau_us * 125)          # Tau delay cycles
-                
-                # --- Step 3: Configure ADC & DMA ---
+                # Refuse, rather than silently truncate, a capture that
+                # does not fit the sample buffers
+                if not 0 < req_datasize <= MAX_SAMPLES:
+                    with tx_lock:   # Don't interleave with a frame being sent
+                        print(f"Error: Data Size must be 1-{MAX_SAMPLES}")
+                    continue
                 
-                # Calculate ADC Clock Divider to match requested 'sleep_time'
-                # ADC Base Clk = 48MHz. 
-                # Formula: Sampling Rate = 48MHz / (DIV + 1)
-                # We approximate: Div = (sleep_time_us * 48) - 1
                 if sleep_time < 2: sleep_time = 2 # Clamp minimum speed
-                div_val = (sleep_time * 48) - 1
-                machine.mem32[ADC_DIV] = (div_val << 8) # Register takes 8.8 fixed point
-                
-                # Enable ADC FIFO and DREQ (Data Request)
-                # FCS Register bits:
-                # [0] EN = 1
-                # [3] DREQ_EN = 1 (Request DMA when data available)
-                # [24:27] THRESH = 1 (Trigger when at least 1 sample in FIFO)
-                machine.mem32[ADC_FCS] = (1 << 0) | (1 << 3) | (1 << 24)
-                
-                # Determine memory buffer size
-                # For CPMG, we ideally capture the entire echo train.
-                # If 'FID', we might just capture `req_datasize`.
-                # We trust the GUI/User to request a reasonable `datasize`.
-                datasize = req_datasize
-                if datasize > 20000: datasize = 20000 # Safety cap for RAM
                 
-                buf = bytearray(datasize * 2) # 16-bit samples = 2 bytes each
+                # For CPMG, we capture the entire echo train but nothing after
+                # it: the train ends one tau after the last echo centre, and
+                # samples past that would only be noise to store and send.
+                # The DATA header reports the shorter frame to the PC.
+                if cmd == "CPMG":
+                    n_loops = max(n_echoes, 1)      # Echoes the PIO actually runs
+                    train_us = ((PULSE_CYCLES + n_loops * PULSE180_CYCLES) // CYCLES_PER_US
+                                + tau_us * (2 * n_loops + 1))
+                    train_samples = train_us // sleep_time + 1
+                    if req_datasize > train_samples: req_datasize = train_samples
                 
-                # Configure DMA to fill this buffer
-                dma.config(buf, datasize)
-                
-                # Configure ADC Input Mux
-                # CS Register: Select Input 2 (GP28) -> Bits [12:14] = 2
-                cs_val = machine.mem32[ADC_CS]
-                cs_val &= ~(7 << 12) # Clear current mux
-                cs_val |= (2 << 12)  # Set mux to 2
-                cs_val |= (1 << 3)   # Set START_MANY (Continuous capture)
-                machine.mem32[ADC_CS] = cs_val
-                
-                # --- Step 4: Sequence Execution ---
-                det_switch.value(1) # Enable Rx Isolation (connect coil to amp)
-                time.sleep_us(20)   # Allow relay/switch to settle
-                
-                # Reset PIO State Machine to ensure fresh start
-                sm.active(0)
-                sm.restart()
-                sm.active(1)
-                
-                # Push parameters to PIO FIFO
-                sm.put(pulse_cycles)    # 90 pulse length
-                sm.put(tau_cycles)      # Tau length
-                sm.put(n_echoes)        # Loop count
-                sm.put(pulse180_cycles) # 180 pulse length
-                
-                # The PIO will now run.
-                # It will trigger IRQ/Timings.
-                # The DMA is waiting for ADC data.
-                # The ADC is waiting for 'START_MANY' (which we set).
-                # Note: In this architecture, ADC is free-running. Ideally, PIO 
-                # implies strict sync. Synchronization here relies on the fact 
-                # that we start them roughly together. For stricter sync, 
-                # PIO can trigger the specific ADC conversion pin, but free-running
-                # is often sufficient for basic CPMG envelopes.
-                
-                # Wait for DMA to complete (filling the buffer)
-                dma.wait()
-                
-                # --- Step 5: Stop & Cleanup ---
-                sm.active(0)                        # Stop PIO
-                machine.mem32[ADC_CS] &= ~(1 << 3)  # Stop ADC (Clear START_MANY)
-                dma.disable()                       # Stop DMA
-                det_switch.value(0)                 # Disable Rx
-                led.value(0)                        # LED Off
-                
-                # --- Step 6: Data Transmission ---
-                # Send data back to PC.
-                # Format: Time(us),Value
-                # We reconstruct time based on the known interval.
-                t_us = 0
-                for i in range(datasize):
-                    # Combine 2 bytes into 16-bit integer
-                    val = buf[2*i] | (buf[2*i+1] << 8)
-                    print(f"{t_us},{val}")
-                    t_us += sleep_time
+                # --- Step 1: Pre-Polarization ---
+                # Turn on the strong magnet coil to align spins and come back
+                # to the loop; the acquisition starts when the deadline passes.
+                led.value(1)
+                pp_coil.value(1)
+                polarize_until = time.ticks_add(time.ticks_ms(), POLARIZE_MS)
+                pending = (sleep_time, req_datasize, tau_us, n_echoes)
+                state = POLARIZING
+        
+        if state == POLARIZING and time.ticks_diff(polarize_until, time.ticks_ms()) <= 0:
+            pp_coil.value(0)    # Turn off quickly
+            sleep_time, req_datasize, tau_us, n_echoes = pending
+            state = IDLE
+            
+            # --- Step 2: Calculate Timing & Cycles ---
+            # Convert times to PIO clock cycles. Pulse lengths are fixed
+            # (PULSE_CYCLES / PULSE180_CYCLES); only tau comes from the command.
+            tau_cycles = tau_us * CYCLES_PER_US     # Tau delay cycles
+            
+            # --- Step 3: Configure ADC & DMA ---
+            
+            # Calculate ADC Clock Divider to match requested 'sleep_time'
+            # ADC Base Clk = 48MHz. 
+            # Formula: Sampling Rate = 48MHz / (DIV + 1)
+            # We approximate: Div = (sleep_time_us * 48) - 1
+            div_val = (sleep_time * 48) - 1
+            
+            # Memory buffer size (checked against MAX_SAMPLES and, for CPMG,
+            # capped at the echo train length when the command was parsed)
+            datasize = req_datasize
+            
+            buf = BUFS[acq_idx]
+            
+            # Set the clock divider, enable FIFO + DREQ, select GP28 and
+            # flush the FIFO; the ADC stays idle until the PIO starts it
+            adc_arm(div_val)
+            
+            # Configure DMA to fill the first 'datasize' samples of this run's buffer
+            dma.config(buf, datasize)
+            
+            # Arm the ADC start: the word the PIO pushes goes straight to ADC_CS
+            adc_trig.config_word(PIO0_RXF0, ADC_CS, DREQ_PIO0_RX0)
+            
+            # --- Step 4: Sequence Execution ---
+            det_switch.value(1) # Enable Rx Isolation (connect coil to amp)
+            time.sleep_us(20)   # Allow relay/switch to settle
+            
+            # Fill in this run's PIO parameters (in the order the program pulls them)
+            PARAMS[2] = tau_cycles          # Tau length
+            PARAMS[3] = max(n_echoes, 1) - 1 # Loop count (jmp x_dec runs X + 1 times)
+            PARAMS[5] = tau_cycles          # Tau length (held in OSR for the echo loop)
+            
+            # Reset PIO State Machine to ensure fresh start
+            sm.active(0)
+            sm.restart()
+            sm.active(1)
+            
+            # Push parameters to PIO FIFO
+            sm.put(PARAMS)                  # All six words in one call
+            
+            # The PIO will now run.
+            # It starts the ADC (via adc_trig) on the cycle before the 90 pulse,
+            # so sampling is locked to the pulse sequence.
+            # The DMA moves each ADC result into buf as it is produced.
+            
+            # Wait for DMA to complete (filling the buffer)
+            dma.wait()
+            
+            # --- Step 5: Stop & Cleanup ---
+            teardown()                          # Stop ADC, Disable Rx, LED Off
+            sm.active(0)                        # Stop PIO
+            sm.exec("nop().side(0)")            # Force PULSE OFF (may stop mid-pulse)
+            dma.disable()                       # Stop DMA
+            adc_trig.disable()                  # Disarm ADC start (if never fired)
+            
+            # A short capture can end before the PIO has pulled all of PARAMS.
+            # restart() does not empty the FIFOs, so clear them here or the
+            # next run would pull leftover words (and adc_trig could copy
+            # one into ADC_CS).
+            shiftctrl = machine.mem32[PIO0_SM0_SHIFTCTRL]
+            machine.mem32[PIO0_SM0_SHIFTCTRL] = shiftctrl ^ (1 << 31)
+            machine.mem32[PIO0_SM0_SHIFTCTRL] = shiftctrl
+            
+            # --- Step 6: Data Transmission ---
+            # Wait until core 1 has finished sending the previous capture
+            # (usually long done during pre-polarisation), hand it this
+            # buffer, and return to the command loop immediately.
+            # The next acquisition fills the other buffer.
+            tx_lock.acquire()
+            tx_job[0] = buf
+            tx_job[1] = datasize
+            tx_job[2] = sleep_time
+            tx_ready.release()
+            acq_idx ^= 1
 
 if __name__ == "__main__":
     main()